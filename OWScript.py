@@ -1,7 +1,7 @@
 import argparse
 import os
-import re
 import sys
+import tempfile
 import time
 from OWScript import Errors
 from OWScript.Errors import Logger
@@ -9,6 +9,20 @@ from OWScript.Lexer import Lexer
 from OWScript.Parser import Parser
 from OWScript.Transpiler import Transpiler
 
+# Whitespace removed by --min: the characters matched by the regex `\s` (none lie above U+3000)
+_WS_DELETE = str.maketrans('', '', ''.join(c for c in map(chr, range(0x3001)) if c.isspace()))
+
+def save_output(temp_path, save_path):
+    """Moves the generated output onto the save path, keeping the permissions a regular write would give it."""
+    if os.path.exists(save_path):
+        mode = os.stat(save_path).st_mode
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, save_path)
+
 def transpile(text, path, args):
     """Transpiles an OWScript code into Overwatch Workshop rules."""
     start = time.time()
@@ -27,9 +41,8 @@ def transpile(text, path, args):
         print(tree.string())
     logger = Logger(log_level=args.debug)
     transpiler = Transpiler(tree=tree, path=path, logger=logger, credit=args.no_credit)
-    code = transpiler.run()
-    if args.min:
-        code = re.sub(r'[\s\n]*', '', code)
+    # The clipboard needs the complete output, everything else is written as it is generated
+    copied = []
     if not args.save:
         if sys.stdout.encoding.strip() != 'utf-8':
             sys.stderr.write(
@@ -37,28 +50,50 @@ def transpile(text, path, args):
                 'unicode characters on the output will be interpreted as ascii. '
                 'Consider using `set PYTHONIOENCODING=utf_8` and running the command again.'
             )
-        sys.stdout.write(code)
+        output = sys.stdout
+        write = output.write
     else:
-        try:
-            with open(args.save, 'wb') as f:
-                code = code.encode('utf-8')
-                f.write(code)
-        except FileNotFoundError:
+        save_dir = os.path.dirname(os.path.abspath(args.save))
+        if not os.path.isdir(save_dir):
             raise Errors.FileNotFoundError('Output directory not found.')
             sys.exit(Errors.ExitCode.OutputNotFound)
+        # Written next to the save path and moved onto it once the whole output is generated,
+        # so a failed compile leaves an existing file untouched
+        output = tempfile.NamedTemporaryFile(dir=save_dir, prefix='.owscript-', delete=False)
+        write = lambda code: output.write(code.encode('utf-8'))
+    def emit(code):
+        if args.min:
+            code = code.translate(_WS_DELETE)
+        if args.copy:
+            copied.append(code)
+        write(code)
+    try:
+        transpiler.run(write=emit)
+        if args.save:
+            output.close()
+            save_output(output.name, args.save)
+    finally:
+        if args.save:
+            output.close()
+            if os.path.exists(output.name):
+                os.remove(output.name)
     if args.copy:
         import pyperclip
-        pyperclip.copy(code)
+        pyperclip.copy(''.join(copied))
         sys.stdout.write('\nCode copied to clipboard.')
     end = time.time()
     if args.time:
         print('\nTime Elapsed: {}s'.format(round(end - start, 2)))
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Generate Overwatch Workshop code from OWScript')
+    parser = argparse.ArgumentParser(
+        description='Generate Overwatch Workshop code from OWScript',
+        epilog='Rules are printed as soon as they are generated. If a rule fails to compile, the rules before it '
+               'have already been printed and the command exits with an error code. A file given to --save is '
+               'only written once the whole script compiles.')
     parser.add_argument('input', nargs='*', type=str, help='Standard input to process')
     parser.add_argument('-m', '--min', action='store_true', help='Minifies the output by removing whitespace')
-    parser.add_argument('-s', '--save', help='Save the output to a file instead of printing it')
+    parser.add_argument('-s', '--save', help='Save the output to a file instead of printing it (only written if compiling succeeds)')
     parser.add_argument('-c', '--copy', action='store_true', help='Copies output to clipboard automatically')
     parser.add_argument('-t', '--time', action='store_true', help='Debug: outputs the time elapsed to generate the output')
     parser.add_argument('-d', '--debug', type=int, default=Logger.WARN, help='The severity level of the logger (1=Info, 2=Warning, 3=Debug)')
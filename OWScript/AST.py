@@ -271,7 +271,14 @@ class Number(WorkshopType):
         self.value = value
 
     def __int__(self):
-        return int(self.value)
+        try:
+            return int(self.value)
+        except ValueError:
+            # Folded constants are formatted as floats (e.g. '3.0'), accept them only when integral
+            value = float(self.value)
+            if not value.is_integer():
+                raise
+            return int(value)
 
     def __add__(self, other):
         return float(self.value) + float(other.value)
@@ -361,6 +368,7 @@ class OWID(AST):
     def __init__(self, name, description='', args=[]):
         super().__init__()
         self.name = name
+        self.name_title = name.title()
         self.description = description
         self.args = args
 
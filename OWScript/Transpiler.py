@@ -1,6 +1,7 @@
+import operator
 import os
-import re
-from collections import defaultdict
+from collections import defaultdict, deque
+from functools import lru_cache
 from itertools import count
 from string import ascii_uppercase as letters
 
@@ -8,17 +9,53 @@ from . import Errors
 from . import Importer
 from .AST import *
 
+# Operator tables shared by every visit instead of being rebuilt per node
+_BINOP_FUNCS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '^': operator.pow,
+    '%': operator.mod
+}
+_BINOP_NAMES = {
+    '+': 'Add',
+    '-': 'Subtract',
+    '*': 'Multiply',
+    '/': 'Divide',
+    '^': 'Raise To Power',
+    '%': 'Modulo',
+    'or': 'Or',
+    'and': 'And'
+}
+_COMPOUND_OPS = {
+    '+=': '+',
+    '-=': '-',
+    '*=': '*',
+    '/=': '/',
+    '^=': '^',
+    '%=': '%'
+}
+
 def flatten(l):
     """Helper method to convert a list of lists into a single list."""
-    l = list(l)
-    while l:
-        while l and isinstance(l[0], list):
-            l[0:1] = l[0]
-        if l:
-            yield l.pop(0)
+    stack = deque(l)
+    while stack:
+        x = stack.popleft()
+        if isinstance(x, list):
+            stack.extendleft(reversed(x))
+        else:
+            yield x
+
+@lru_cache(maxsize=None)
+def arg_values(arg):
+    """Returns the set of values accepted by a workshop argument type. Cached since it only depends on the type."""
+    return frozenset(x.replace(',', '') for x in flatten(arg.get_values()))
 
 class Scope:
     """Keeps track of defined names in a scope context. Handles lookup and assignment."""
+    __slots__ = ('name', 'parent', 'namespace', 'level')
+
     def __init__(self, name, parent=None, namespace=None):
         self.name = name
         self.parent = parent
@@ -33,11 +70,12 @@ class Scope:
         return keys
 
     def get(self, name):
-        value = self.namespace.get(name)
-        if value is not None:
-            return value
-        if self.parent:
-            return self.parent.get(name)
+        scope = self
+        while scope is not None:
+            value = scope.namespace.get(name)
+            if value is not None:
+                return value
+            scope = scope.parent
 
     def assign(self, name, var):
         self.namespace[name] = var
@@ -76,10 +114,13 @@ class Builtin:
         node.children.extend([array, value])
         return node
 
-    range: range
-    ceil: ceil
-    floor: floor
-    get_map: get_map
+# Built-in functions available in the global scope, by name
+_BUILTINS = {
+    'range': Builtin.range,
+    'ceil': Builtin.ceil,
+    'floor': Builtin.floor,
+    'get_map': Builtin.get_map
+}
 
 class Transpiler:
     """Compiles a parse tree into a single string output via the `run` method."""
@@ -90,6 +131,8 @@ class Transpiler:
         self.credit = credit
         self.indent_size = indent_size
         self.indent_level = 0
+        # Indentation strings by level, extended on demand by `tabs`
+        self._tabs = [' ' * indent_size * level for level in range(16)]
         # Reserved Global Indices
         # 0: Map ID
         self.global_reserved = 1
@@ -104,10 +147,22 @@ class Transpiler:
         self.curblock = []
         # Keeps track of absolute import paths to avoid duplicate imports
         self.imports = set()
+        # Maps node types to their visitor method so `visit` avoids a name lookup per node
+        self._visitors = {cls: getattr(self, 'visit' + cls.__name__) for cls in (
+            Script, Import, Rule, Raw, Function, Class, Block, Ruleblock, OWID, Constant, Compare, Assign,
+            If, While, For, BinaryOp, UnaryOp, Var, String, Number, Time, Vector, Array, Item, Attribute,
+            Call, Return)}
+        # Maps assignment targets to the method handling that kind of assignment
+        self._assign_handlers = {Var: self._assign_var, Item: self._assign_item, Attribute: self._assign_attribute}
+        # Workshop output of constants and time literals, which only depends on their name/value
+        self._constant_code = {}
+        self._time_code = {}
 
     @property
     def tabs(self):
-        return ' ' * self.indent_size * self.indent_level
+        while self.indent_level >= len(self._tabs):
+            self._tabs.append(' ' * self.indent_size * len(self._tabs))
+        return self._tabs[self.indent_level]
 
     @property
     def min_wait(self):
@@ -124,20 +179,20 @@ class Transpiler:
         skips = []
         skip_to = []
         for line_no, line in enumerate(self.curblock):
-            match = re.match(r'\s*//SKIP TO', line)
-            if match:
+            stripped = line.lstrip()
+            if stripped.startswith('//SKIP TO'):
                 skips.append(line_no)
-                self.curblock[line_no] = re.sub('//SKIP TO', '', line)
-            match = re.match(r'\s*//FOR START', line)
-            if match:
+                self.curblock[line_no] = line.replace('//SKIP TO', '', 1)
+            elif stripped.startswith('//FOR START'):
                 skip_to.append(line_no - 1)
-                self.curblock[line_no] = re.sub('//FOR START', '', line)
+                self.curblock[line_no] = line.replace('//FOR START', '', 1)
         for skip, jump in zip(skips, skip_to[::-1]):
             self.curblock[skip] = self.curblock[skip].format(jump)
 
     def resolve_import(self, node, scope):
         """Extends the current parse tree by evaluating the given import path (recursively)."""
-        children = self.visit(node, scope).children
+        # Imported trees are parsed separately, so fold them like the main tree before splicing them in
+        children = self.fold_constants(self.visit(node, scope).children)
         nodes = []
         for child in children:
             if type(child) == Import:
@@ -166,23 +221,58 @@ class Transpiler:
             node = self.resolve_name(getattr(node.parent, node.name), node.parent.env)
         return node
 
+    def fold_binary(self, node):
+        """Evaluates a binary operation between two numeric literals, or returns None if it cannot be folded."""
+        if type(node.left) == Number and type(node.right) == Number:
+            func = _BINOP_FUNCS.get(node.op)
+            if func:
+                try:
+                    result = func(node.left, node.right)
+                    return Number(value='{}'.format(result))
+                except ZeroDivisionError:
+                    return Number(value='0')
+
+    def fold_constants(self, node):
+        """Replaces constant binary operations in the parse tree with their result before code generation."""
+        if type(node) == list:
+            for index, child in enumerate(node):
+                node[index] = self.fold_constants(child)
+            return node
+        if not isinstance(node, AST):
+            return node
+        for attr, value in vars(node).items():
+            if type(value) == list or isinstance(value, AST):
+                setattr(node, attr, self.fold_constants(value))
+        if type(node) == BinaryOp:
+            folded = self.fold_binary(node)
+            if folded is not None:
+                return folded
+        return node
+
     def visitScript(self, node, scope):
-        """Root node generates the final code output and resolves all imports."""
-        # Shameless plug + base code for `get_map` functionality
-        code = ''
+        """Root node generates the final code output and resolves all imports. Each top-level rule is passed on
+        to the output with `emit` as soon as it is generated."""
+        # Shameless plug + base code for `get_map` functionality, held back until the first rule compiles
+        # so a script that fails early produces no output
+        header = []
         if not self.credit:
-            code += r'rule("Generated by https://github.com/adapap/OWScript") { Event { Ongoing - Global; }}' + '\n'
+            header.append(r'rule("Generated by https://github.com/adapap/OWScript") { Event { Ongoing - Global; }}' + '\n')
         if node.map_rule:
-            code += r'rule("Map ID Initialization") { Event { Ongoing - Global; } Actions { Set Global Variable At Index(A, 0, Round To Integer(Add(Distance Between(Nearest Walkable Position(Vector(-500.000, 0, 0)), Nearest Walkable Position(Vector(500, 0, 0))), Distance Between(Nearest Walkable Position(Vector(0, 0, -500.000)), Nearest Walkable Position(Vector(0, 0, 500)))), Down)); }}' + '\n'
+            header.append(r'rule("Map ID Initialization") { Event { Ongoing - Global; } Actions { Set Global Variable At Index(A, 0, Round To Integer(Add(Distance Between(Nearest Walkable Position(Vector(-500.000, 0, 0)), Nearest Walkable Position(Vector(500, 0, 0))), Distance Between(Nearest Walkable Position(Vector(0, 0, -500.000)), Nearest Walkable Position(Vector(0, 0, 500)))), Down)); }}' + '\n')
         self.chase_vars.update(node.chase_vars)
         while len(node.children) > 0:
             child = node.children[0]
             if type(child) == Import:
                 node.children = self.resolve_import(child, scope) + node.children[1:]
             else:
-                code += self.visit(child, scope)
+                code = self.visit(child, scope)
+                # Definitions such as functions produce no code, so they don't release the header
+                if code:
+                    self.emit(''.join(header) + code)
+                    header = []
                 node.children = node.children[1:]
-        return code.rstrip('\n')
+        self.emit(''.join(header))
+        return ''
 
     def visitImport(self, node, scope):
         """Handles `#import` tokens, duplicate imports, and invalid paths."""
@@ -202,15 +292,17 @@ class Transpiler:
             raise Errors.ImportError('Failed to import \'{}\' due to the following error:\n{}'.format(node.path, ex), pos=node._pos)
     def visitRule(self, node, scope):
         """Creates a basic workshop rule."""
-        code = ''
+        parts = []
         if node.disabled:
-            code += 'disabled '
-        code += 'rule('
-        code += '"' + ''.join(x if type(x) == str else self.visit(x, scope) for x in node.name) + '"'
+            parts.append('disabled ')
+        parts.append('rule("')
+        parts.extend(x if type(x) == str else self.visit(x, scope) for x in node.name)
         self.indent_level += 1
-        code += ') {\n' + '\n'.join(self.visit_children(node, scope)) + '}\n'
+        parts.append('") {\n')
+        parts.append('\n'.join(self.visit_children(node, scope)))
+        parts.append('}\n')
         self.indent_level -= 1
-        return code
+        return ''.join(parts)
 
     def visitRaw(self, node, scope):
         """Returns an exact value for a string without further interpretation."""
@@ -231,17 +323,16 @@ class Transpiler:
 
     def visitBlock(self, node, scope):
         """Visits a collection of statements."""
-        code = ''.join(self.visit_children(node, scope))
-        return code
+        visit = self.visit
+        return ''.join([visit(child, scope) for child in node.children])
 
     def visitRuleblock(self, node, scope):
         """A rule category such as Events, Conditions, or Actions."""
         if not node.children:
             return self.tabs + node.name + '{}\n'
-        code = self.tabs + node.name + ' {'
-        block = ''
+        parts = [self.tabs, node.name, ' {']
+        blocks = []
         self.indent_level += 1
-        block = ''
         for ruleblock in node.children:
             self.curblock = []
             for line in ruleblock.children:
@@ -256,19 +347,18 @@ class Transpiler:
                                 child += ' == True'
                             self.curblock.append(child)
             self.resolve_skips()
-            block += ';\n'.join(self.curblock)
-        if block:
-            code += '\n' + block
-        else:
-            return code + '}\n'
+            blocks.append(';\n'.join(self.curblock))
+        block = ''.join(blocks)
+        if not block:
+            parts.append('}\n')
+            return ''.join(parts)
         self.indent_level -= 1
-        code += ';\n' + self.tabs + '}\n'
-        return code
+        parts.extend(['\n', block, ';\n', self.tabs, '}\n'])
+        return ''.join(parts)
 
     def visitOWID(self, node, scope):
         """A workshop value that takes any number of parameters, such as `Set Facing(...)`."""
-        name = node.name.title()
-        code = name
+        name = node.name_title
         # Autofill WaitBehavior
         if name == 'Wait' and len(node.children) == 1:
             node.children.append(Constant(name='Ignore Condition'))
@@ -288,9 +378,9 @@ class Transpiler:
                 if not var:
                     raise Errors.NameError('\'{}\' is undefined'.format(child.name), pos=node._pos)
                 node.children[index] = Raw(code=var.data.letter)
-                print(var.data.letter)
+                self.logger.debug('Chase variable:', var.data.letter)
                 continue
-            values = list(map(lambda x: x.replace(',', ''), flatten(arg.get_values())))
+            values = arg_values(arg)
             value = self.visit(child, scope).upper()
             if value in HeroConstant._values and name != 'Hero':
                 node.children[index] = Constant(name='Hero({})'.format(value.title()))
@@ -300,12 +390,14 @@ class Transpiler:
                 raise Errors.InvalidParameter('\'{}\' expected type {} for argument {}'.format(
                     name, arg.__name__, index + 1), pos=child._pos)
         children = [self.visit(child, scope) for child in node.children]
-        code += '(' + ', '.join(children) + ')'
-        return code
+        return f'{name}({", ".join(children)})'
 
     def visitConstant(self, node, scope):
         """A workshop value with no further parameters, such as `Event Player` or `Yellow`."""
-        return node.name.title()
+        code = self._constant_code.get(node.name)
+        if code is None:
+            code = self._constant_code[node.name] = node.name.title()
+        return code
 
     def visitCompare(self, node, scope):
         """Interprets a comparison expression."""
@@ -317,96 +409,108 @@ class Transpiler:
 
     def visitAssign(self, node, scope):
         """Handles internal variable definition and assignment."""
-        code = ''
-        value = {
-            '+=': BinaryOp(left=node.left, op='+', right=node.right),
-            '-=': BinaryOp(left=node.left, op='-', right=node.right),
-            '*=': BinaryOp(left=node.left, op='*', right=node.right),
-            '/=': BinaryOp(left=node.left, op='/', right=node.right),
-            '^=': BinaryOp(left=node.left, op='^', right=node.right),
-            '%=': BinaryOp(left=node.left, op='%', right=node.right)
-        }.get(node.op, node.right)
-        # Define variables
-        if type(node.left) == Var:
-            var = node.left
-            name = var.name
-            cur_var = scope.get(name)
-            if not cur_var:
-                letter = 'A'
-                if var.type == Var.GLOBAL:
-                    if name in self.chase_vars:
-                        if name not in self.letters:
-                            try:
-                                self.letters[name] = next(self.global_letters)
-                            except StopIteration:
-                                raise Errors.InvalidParameter('Exceeded maximum number of chase variables (25) for this type.', pos=child._pos)
-                        letter = self.letters[name]
-                        index = None
-                    else:
-                        index = next(self.global_index)
-                    var.data = GlobalVar(letter=letter, index=index)
-                elif var.type == Var.PLAYER:
-                    if name in self.chase_vars:
-                        if name not in self.letters:
-                            try:
-                                self.letters[name] = next(self.player_letters)
-                            except StopIteration:
-                                raise Errors.InvalidParameter('Exceeded maximum number of chase variables (25) for this type.', pos=child._pos)
-                        letter = self.letters[name]
-                        index = None
-                    else:
-                        index = next(self.global_index)
-                    player = self.resolve_name(var.player, scope)
-                    var.data = PlayerVar(letter=letter, index=index, player=player)
-            elif var.type != Var.GLOBAL and cur_var.type != var.type:
-                self.logger.warn('Ignoring type reassign for \'{}\' (Line {}:{})'.format(var.name, *var._pos))
-                var = cur_var
-            elif cur_var.type != Var.CONST:
-                var = cur_var
-            else:
-                raise Errors.SyntaxError('Cannot assign to const \'{}\''.format(var.name), pos=node._pos)
-            if var.type != Var.PLAYER and var.player is not None:
-                raise Errors.SyntaxError('Cannot target player for non-player variable \'{}\''.format(var.name), pos=node._pos)
-            var.value = value
-            scope.assign(name=name, var=var)
-        elif type(node.left) == Item:
-            parent = node.left.parent
-            name = parent.name
-            var = scope.get(name)
-            try:
-                assert type(var.value) == Array
-                index = int(self.visit(node.left.index, scope))
-                var.value[index] = value
-            except AssertionError:
-                raise Errors.SyntaxError('Cannot assign to \'{}\'using indices (value is not an array)'.format(name), pos=node._pos)
-            except ValueError:
-                raise Errors.NotImplementedError('Array assignment only supports literal integer indices', pos=node._pos)
-            scope.assign(name=name, var=var)
-        elif type(node.left) == Attribute:
-            if type(node.left.parent) == Object:
-                obj = node.left.parent
-            else:
-                obj = scope.get(node.left.parent.name).value
-            if not type(obj) == Object:
-                raise Errors.SyntaxError('Cannot assign value to attributes')
-            resolved = self.resolve_name(value, scope)
-            var = Var(name=node.left.name, type_=Var.INTERNAL, value=resolved)
-            if type(resolved) == String:
-                var.type = Var.STRING
-            obj.env.assign(node.left.name, var)
-            return code
+        if node.op in _COMPOUND_OPS:
+            value = BinaryOp(left=node.left, op=_COMPOUND_OPS[node.op], right=node.right)
         else:
-            raise Errors.NotImplementedError('Cannot assign value to {}'.format(type(node.left).__name__), pos=node._pos)
+            value = node.right
+        handler = self._assign_handlers.get(type(node.left), self._assign_unsupported)
+        return handler(node, value, scope)
+
+    def _assign_var(self, node, value, scope):
+        """Defines a variable or reassigns an existing one."""
+        var = node.left
+        name = var.name
+        cur_var = scope.get(name)
+        if not cur_var:
+            letter = 'A'
+            if var.type == Var.GLOBAL:
+                if name in self.chase_vars:
+                    if name not in self.letters:
+                        try:
+                            self.letters[name] = next(self.global_letters)
+                        except StopIteration:
+                            raise Errors.InvalidParameter('Exceeded maximum number of chase variables (25) for this type.', pos=child._pos)
+                    letter = self.letters[name]
+                    index = None
+                else:
+                    index = next(self.global_index)
+                var.data = GlobalVar(letter=letter, index=index)
+            elif var.type == Var.PLAYER:
+                if name in self.chase_vars:
+                    if name not in self.letters:
+                        try:
+                            self.letters[name] = next(self.player_letters)
+                        except StopIteration:
+                            raise Errors.InvalidParameter('Exceeded maximum number of chase variables (25) for this type.', pos=child._pos)
+                    letter = self.letters[name]
+                    index = None
+                else:
+                    index = next(self.global_index)
+                player = self.resolve_name(var.player, scope)
+                var.data = PlayerVar(letter=letter, index=index, player=player)
+        elif var.type != Var.GLOBAL and cur_var.type != var.type:
+            self.logger.warn('Ignoring type reassign for \'{}\' (Line {}:{})'.format(var.name, *var._pos))
+            var = cur_var
+        elif cur_var.type != Var.CONST:
+            var = cur_var
+        else:
+            raise Errors.SyntaxError('Cannot assign to const \'{}\''.format(var.name), pos=node._pos)
+        if var.type != Var.PLAYER and var.player is not None:
+            raise Errors.SyntaxError('Cannot target player for non-player variable \'{}\''.format(var.name), pos=node._pos)
+        var.value = value
+        scope.assign(name=name, var=var)
+        return self._assign_value(name, scope)
+
+    def _assign_item(self, node, value, scope):
+        """Assigns a value to an element of an array variable."""
+        parent = node.left.parent
+        name = parent.name
+        var = scope.get(name)
+        try:
+            assert type(var.value) == Array
+            index = node.left.index
+            # Number.__int__ also accepts integral folded constants such as '1.0'
+            index = int(index) if type(index) == Number else int(self.visit(index, scope))
+            var.value[index] = value
+        except AssertionError:
+            raise Errors.SyntaxError('Cannot assign to \'{}\'using indices (value is not an array)'.format(name), pos=node._pos)
+        except ValueError:
+            raise Errors.NotImplementedError('Array assignment only supports literal integer indices', pos=node._pos)
+        scope.assign(name=name, var=var)
+        return self._assign_value(name, scope)
+
+    def _assign_attribute(self, node, value, scope):
+        """Assigns a value to an attribute of an object."""
+        if type(node.left.parent) == Object:
+            obj = node.left.parent
+        else:
+            obj = scope.get(node.left.parent.name).value
+        if not type(obj) == Object:
+            raise Errors.SyntaxError('Cannot assign value to attributes')
+        resolved = self.resolve_name(value, scope)
+        var = Var(name=node.left.name, type_=Var.INTERNAL, value=resolved)
+        if type(resolved) == String:
+            var.type = Var.STRING
+        obj.env.assign(node.left.name, var)
+        return ''
+
+    def _assign_unsupported(self, node, value, scope):
+        """Rejects assignment to any other kind of node."""
+        raise Errors.NotImplementedError('Cannot assign value to {}'.format(type(node.left).__name__), pos=node._pos)
+
+    def _assign_value(self, name, scope):
+        """Generates the workshop action that stores the value of an assigned variable."""
         var = scope.get(name)
         data = var.data
         value = self.visit(var.value, scope)
         if value == '':
-            return code
+            return ''
         elif type(value) == Object:
             var.type = Var.OBJECT
             var.value = value
             scope.assign(name=name, var=var)
-            return code
+            return ''
+        code = ''
         if var.type == Var.GLOBAL:
             if data.index is not None:
                 code += 'Set Global Variable At Index({}, {}, {})'.format(data.letter, data.index, self.visit(var.value, scope))
@@ -422,41 +526,47 @@ class Transpiler:
     def visitIf(self, node, scope):
         """If blocks contain a true and false block to evaluate. To simulate this in workshop, the false block
         is skipped when the condition is true, and vice-versa."""
+        return self.visit_if(node, scope)[0]
+
+    def visit_if(self, node, scope):
+        """Generates the code for an if block along with its number of statements."""
         cond = self.visit(node.cond, scope)
         skip_code = 'Skip If(Not({}), {});\n'
         skip_false = ''
-        true_code = ';\n'.join(self.visit_children(node.true_block, scope)) + ';\n'
+        true_lines, true_count = self.visit_statements(node.true_block.children, scope)
+        true_code = ';\n'.join(true_lines) + ';\n'
         false_code = ''
+        false_count = 0
         if node.false_block:
             skip_false = 'Skip({});\n'
             if type(node.false_block) == If:
-                false_code += self.visit(node.false_block, scope)
+                false_code, false_count = self.visit_if(node.false_block, scope)
             else:
-                for line in node.false_block.children:
-                    false_code += self.visit(line, scope) + ';\n'
-        skip_code = skip_code.format(cond, true_code.count(';\n') + bool(node.false_block))
+                false_lines, false_count = self.visit_statements(node.false_block.children, scope)
+                false_code = ''.join([line + ';\n' for line in false_lines])
+        skip_code = skip_code.format(cond, true_count + bool(node.false_block))
         if false_code:
-            skip_false = skip_false.format(false_code.count(';\n'))
-        code = skip_code + true_code + skip_false + false_code
-        return code
+            skip_false = skip_false.format(false_count)
+        code = ''.join((skip_code, true_code, skip_false, false_code))
+        return code, skip_code.count(';\n') + true_count + bool(skip_false) + false_count
 
     def visitWhile(self, node, scope):
         """While loop is simulated by looping the action list while a condition is met.
         Support for while loops is limited."""
         skip_cond = 'Skip If(Not({}), {});\n'
         cond = self.visit(node.cond, scope)
-        block = ';\n'.join(self.visit_children(node.body, scope)) + ';\n'
+        lines, num_lines = self.visit_statements(node.body.children, scope)
+        block = ';\n'.join(lines) + ';\n'
         loop_cond = ';\n{};\nLoop If({})'.format(self.min_wait, cond)
-        num_skips = block.count(';\n') + 2 # Include wait/loop skip
-        skip_cond = skip_cond.format(self.visit(node.cond, scope), num_skips)
-        code = skip_cond + block + loop_cond
-        return code
+        num_skips = num_lines + 2 # Include wait/loop skip
+        skip_cond = skip_cond.format(cond, num_skips)
+        return ''.join((skip_cond, block, loop_cond))
 
     def visitFor(self, node, scope):
         """For loops store a pointer to each element in an iterable and loop the action list until the pointer
         is at the end of the iterable (length of iterable). If the length is a known value (e.g. user-created array),
         then loop unrolling is possible to reduce time and number of actions."""
-        code = ''
+        parts = []
         pointer = node.pointer
         iterable = node.iterable
         if type(iterable) == Var:
@@ -467,11 +577,11 @@ class Transpiler:
             except AssertionError:
                 raise Errors.SyntaxError('{} is not iterable'.format(iterable.name), pos=iterable._pos)
             for elem in array.elements:
-                scope = Scope(name='for', parent=scope)
+                for_scope = Scope(name='for', parent=scope)
                 var = Var(name=pointer.name, type_=Var.INTERNAL, value=elem)
-                scope.assign(pointer.name, var)
-                lines.append(';\n'.join(self.visit_children(node.body, scope)))
-            code += ';\n'.join(lines)
+                for_scope.assign(pointer.name, var)
+                lines.append(';\n'.join(self.visit_children(node.body, for_scope)))
+            parts.append(';\n'.join(lines))
         elif type(iterable) == Call:
             func_name = self.base_node(iterable).name
             func = scope.get(func_name).value
@@ -487,7 +597,7 @@ class Transpiler:
                     result = self.visit_children(node.body, for_scope)
                     if result:
                         lines.append(';\n'.join(result))
-                code += ';\n'.join(lines)
+                parts.append(';\n'.join(lines))
             except AssertionError:
                 raise Errors.SyntaxError('Function call did not return an array', pos=iterable._pos)
             except TypeError as ex:
@@ -500,44 +610,26 @@ class Transpiler:
             var = Var(name=pointer.name, type_=Var.GLOBAL, value=value, data=pointer_var)
             for_scope.assign(pointer.name, var)
             reset_pointer = 'Set Global Variable At Index(A, {}, 0);\n'.format(index)
-            code += reset_pointer
+            parts.append(reset_pointer)
             skip_code = '//FOR STARTSkip If(Compare(Count Of({}), ==, {}), {})'.format(self.visit(iterable, for_scope), self.visit(pointer, for_scope), '{}')
-            block = ';\n'.join(self.visit_children(node.body, for_scope) + [
+            lines, num_lines = self.visit_statements(node.body.children, for_scope)
+            block = ';\n'.join(lines + [
                 'Modify Global Variable At Index(A, {}, Add, 1)'.format(index),
                 self.min_wait,
                 'Loop',
                 reset_pointer])
-            code += skip_code.format(block.count(';\n')) + ';\n' + block
+            # Body statements plus the pointer increment, wait, loop and reset
+            parts.extend([skip_code.format(num_lines + 4), ';\n', block])
             self.curblock.insert(0, self.tabs + '//SKIP TOSkip If(Compare(Value In Array(Global Variable(A), {}), !=, 0), {})'.format(index, '{}'))
-        return code
+        return ''.join(parts)
 
     def visitBinaryOp(self, node, scope):
         """A binary expression takes two operands and one operator (addition, expontentiation, etc)."""
-        if type(node.left) == Number and type(node.right) == Number:
-            func = {
-                '+': lambda a, b: a + b,
-                '-': lambda a, b: a - b,
-                '*': lambda a, b: a * b,
-                '/': lambda a, b: a / b,
-                '^': lambda a, b: a ** b,
-                '%': lambda a, b: a % b
-            }.get(node.op, None)
-            if func:
-                try:
-                    result = func(node.left, node.right)
-                    return self.visit(Number(value='{}'.format(result)), scope)
-                except ZeroDivisionError:
-                    return self.visit(Number(value='0'), scope)
-        code = {
-            '+': 'Add',
-            '-': 'Subtract',
-            '*': 'Multiply',
-            '/': 'Divide',
-            '^': 'Raise To Power',
-            '%': 'Modulo',
-            'or': 'Or',
-            'and': 'And'
-        }.get(node.op)
+        # Operands can still become literals after folding, e.g. when `resolve_name` substitutes arguments
+        folded = self.fold_binary(node)
+        if folded is not None:
+            return self.visit(folded, scope)
+        code = _BINOP_NAMES.get(node.op)
         try:
             code += '(' + self.visit(node.left, scope) + ', ' + self.visit(node.right, scope) + ')'
         except RecursionError:
@@ -602,6 +694,9 @@ class Transpiler:
 
     def visitTime(self, node, scope):
         """Shorthand for writing time values instead of doing integer arithmetic."""
+        code = self._time_code.get(node.value)
+        if code is not None:
+            return code
         time = node.value
         if time.endswith('ms'):
             time = float(time.rstrip('ms')) / 1000
@@ -609,7 +704,8 @@ class Transpiler:
             time = float(time.rstrip('s'))
         elif time.endswith('min'):
             time = float(time.rstrip('min')) * 60
-        return str(round(time, 3))
+        code = self._time_code[node.value] = str(round(time, 3))
+        return code
 
     def visitVector(self, node, scope):
         """Convenient way to represent vector values."""
@@ -622,19 +718,15 @@ class Transpiler:
         """Arrays in OWScript can take any value, including strings and constants such as heroes."""
         if not node.elements:
             return 'Empty Array'
-        else:
-            elements = []
-            for elem in node.elements:
-                if type(elem) in (String, Constant, Var):
-                    elements.append(Constant(name='Null'))
-                else:
-                    elements.append(elem)
-            num_elems = len(elements)
-            if num_elems == 0:
-                return 'Empty Array'
-            code = 'Append To Array(' * num_elems
-            code += 'Empty Array, ' + '), '.join(self.visit(elem, scope) for elem in elements) + ')'
-        return code
+        parts = ['Append To Array(' * len(node.elements), 'Empty Array']
+        for elem in node.elements:
+            parts.append(', ')
+            if type(elem) in (String, Constant, Var):
+                parts.append('Null')
+            else:
+                parts.append(self.visit(elem, scope))
+            parts.append(')')
+        return ''.join(parts)
 
     def visitItem(self, node, scope, visit=True):
         """An item is accessing an element of an array."""
@@ -643,7 +735,10 @@ class Transpiler:
             var = scope.get(node.parent.name)
             if not var:
                 raise Errors.NameError('\'{}\' is undefined'.format(node.parent.name), pos=node.parent._pos)
-            index = int(node.index.value)
+            try:
+                index = int(node.index)
+            except ValueError:
+                raise Errors.SyntaxError('Array index must be an integer, received {}'.format(node.index.value), pos=node.parent._pos)
             array = var.value
             if not type(array) == Array:
                 raise Errors.SyntaxError('Cannot get item from non-array \'{}\''.format(type(array).__name__), pos=node.parent._pos)
@@ -713,7 +808,7 @@ class Transpiler:
                 self.scope = scope
                 result = method(self, *node.args)
             except TypeError as ex:
-                print('Invalid method arguments:', ex)
+                self.logger.debug('Invalid method arguments:', ex)
                 raise Errors.InvalidParameter("'{}' method received invalid arguments".format(parent.name), pos=parent._pos)
             if result:
                 lines.append(self.visit(result, scope))
@@ -790,22 +885,54 @@ class Transpiler:
 
     def visit(self, node, scope):
         """Finds the relevant transpiler method for the current node."""
-        method_name = 'visit' + type(node).__name__
-        visitor = getattr(self, method_name)
+        try:
+            visitor = self._visitors[type(node)]
+        except KeyError:
+            visitor = getattr(self, 'visit' + type(node).__name__)
+            self._visitors[type(node)] = visitor
         return visitor(node, scope)
 
     def visit_children(self, node, scope):
         """Convenience function to visit all children of a node."""
+        visit = self.visit
+        return [visit(child, scope) for child in node.children]
+
+    def visit_statements(self, nodes, scope):
+        """Visits a sequence of statements, returning their code and the number of statements in the block
+        once joined and terminated by `;\\n`. Nested if blocks report their own count instead of being rescanned."""
         lines = []
-        for child in node.children:
-            lines.append(self.visit(child, scope))
-        return lines
+        count = 0
+        for child in nodes:
+            if type(child) == If:
+                code, num_lines = self.visit_if(child, scope)
+            else:
+                code = self.visit(child, scope)
+                num_lines = code.count(';\n')
+            lines.append(code)
+            count += num_lines + 1
+        return lines, count
+
+    def emit(self, code):
+        """Passes generated code to the output. Trailing newlines are held back until more code follows,
+        so the output never ends with one."""
+        stripped = code.rstrip('\n')
+        if stripped:
+            self.write(self.newlines + stripped)
+            self.newlines = code[len(stripped):]
+        else:
+            self.newlines += code
 
-    def run(self):
-        """Evaluates the parse tree from the parser into workshop code."""
+    def run(self, write=None):
+        """Evaluates the parse tree from the parser into workshop code. If `write` is given, the code is passed to it
+        in chunks as it is generated, otherwise the whole output is returned as a string."""
         global_scope = Scope(name='global')
-        for func_name, func in Builtin.__annotations__.items():
+        for func_name, func in _BUILTINS.items():
             var = Var(name=func_name, type_=Var.BUILTIN, value=func)
             global_scope.assign(func_name, var)
-        code = self.visit(self.tree, scope=global_scope)
-        return code
+        self.tree = self.fold_constants(self.tree)
+        parts = []
+        self.write = write or parts.append
+        self.newlines = ''
+        self.visit(self.tree, scope=global_scope)
+        if write is None:
+            return ''.join(parts)